@@ -1,21 +1,38 @@
 import os
-import datetime
+import asyncio
 import threading
 import queue
 import pyaudio
-import wave
+import struct
 import logging
 import time
+import atexit
+from logging.handlers import QueueHandler, QueueListener
+import warnings
 
-# Set up logging
+# audioop is deprecated since Python 3.11 and removed in 3.13, where the
+# audioop-lts package provides the same module
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import audioop
+except ImportError:
+    raise ImportError("audioop is missing; on Python 3.13+ install audioop-lts") from None
+
+# Set up logging: callers only enqueue records, a listener thread does the I/O
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(
+    log_queue,
+    logging.FileHandler('recorder.log'),
+    logging.StreamHandler()
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('recorder.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Audio settings
@@ -23,111 +40,287 @@ CHUNK = 8192
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 44100
+# Rate segments are saved and sent at; plenty for speech and ~1/3 of the bytes
+TRANSFER_RATE = 16000
+# Segments are stored and sent as 8-bit G.711 mu-law, half the bytes of 16-bit PCM
+TRANSFER_ENCODING = "mulaw"
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_MULAW = 7
 RECORD_SECONDS = 30
 OUTPUT_DIR = "recordings"
 
+# Finished segments waiting for the writer thread, and how many capture buffers rotate
+SAVE_QUEUE_SIZE = 4
+SEGMENT_BUFFERS = 2
+# Saved segments kept for transfer before the oldest is dropped (bounds disk use)
+FILE_QUEUE_SIZE = 8
+
 os.makedirs(OUTPUT_DIR, exist_ok=True)
-file_queue = queue.Queue()
+# Full path pattern for a segment, expanded with time.strftime at save time
+SEGMENT_PATH_FORMAT = os.path.join(OUTPUT_DIR, "audio_%Y%m%d_%H%M%S.wav")
+# Segments are only ever read back by this process, so skip atime updates; not
+# every platform has O_NOATIME
+SEGMENT_OPEN_FLAGS = (os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC
+                      | getattr(os, 'O_NOATIME', 0))
+class _FileQueue(asyncio.Queue):
+    """FIFO of saved segments that can also take one back at the head"""
+
+    def put_front_nowait(self, item):
+        # Same bookkeeping as put_nowait, but ahead of newer segments and past maxsize,
+        # so putting a file back never evicts one that was not sent yet
+        self._queue.appendleft(item)
+        self._unfinished_tasks += 1
+        self._finished.clear()
+        self._wakeup_next(self._getters)
+
+# Saved segments ready for transfer, consumed on the asyncio loop
+file_queue = _FileQueue(maxsize=FILE_QUEUE_SIZE)
+
+def _delete_dropped(path):
+    """Delete a recording dropped from the transfer queue; runs on an executor thread"""
+    try:
+        os.unlink(path)
+    except OSError as e:
+        logger.error(f"Failed to delete dropped recording {path}: {e}")
+
+def _enqueue_file(filename):
+    """Queue a saved segment on the loop, deleting the oldest one if transfer has fallen behind"""
+    # A file put back at the head can leave the queue one past full
+    while file_queue.full():
+        dropped = file_queue.get_nowait()
+        logger.warning(f"Transfer queue full, dropped oldest recording: {dropped}")
+        # Unlink off the loop so D-Bus handlers never wait on the SD card
+        asyncio.get_running_loop().run_in_executor(None, _delete_dropped, dropped)
+    file_queue.put_nowait(filename)
+
+# One PortAudio session for the whole process; initializing it probes every ALSA device
+_pyaudio = None
+
+def _get_pyaudio():
+    """Return the shared PyAudio instance, creating it on first use"""
+    global _pyaudio
+    if _pyaudio is None:
+        _pyaudio = pyaudio.PyAudio()
+        atexit.register(_pyaudio.terminate)
+    return _pyaudio
+
+def _wav_header(nframes, nchannels, sampwidth, rate, format_tag=WAVE_FORMAT_PCM):
+    """Build the RIFF/WAVE header for nframes of audio; odd-sized data must be followed by a pad byte"""
+    data_size = nframes * nchannels * sampwidth
+    fmt = struct.pack('<HHIIHH', format_tag, nchannels, rate,
+                      rate * nchannels * sampwidth, nchannels * sampwidth, sampwidth * 8)
+    if format_tag == WAVE_FORMAT_PCM:
+        fact = b''
+    else:
+        # Non-PCM formats use the WAVEFORMATEX fmt with cbSize, plus a fact chunk with the frame count
+        fmt += struct.pack('<H', 0)
+        fact = struct.pack('<4sII', b'fact', 4, nframes)
+    riff_size = 4 + 8 + len(fmt) + len(fact) + 8 + data_size + (data_size & 1)
+    return (struct.pack('<4sI4s4sI', b'RIFF', riff_size, b'WAVE', b'fmt ', len(fmt))
+            + fmt + fact + struct.pack('<4sI', b'data', data_size))
 
 class AudioRecorder:
-    def __init__(self):
+    def __init__(self, loop=None):
         self.is_recording = False
+        # Event loop that consumes file_queue; None when running standalone
+        self._loop = loop
         try:
-            self.p = pyaudio.PyAudio()
-            # List available audio devices
-            for i in range(self.p.get_device_count()):
-                device_info = self.p.get_device_info_by_index(i)
-                logger.info(f"Audio device {i}: {device_info['name']}")
-                logger.info(f"Max Input Channels: {device_info['maxInputChannels']}")
+            self.p = _get_pyaudio()
+            # List available audio devices; querying each one is slow, so only when debugging
+            if logger.isEnabledFor(logging.DEBUG):
+                devices = []
+                for i in range(self.p.get_device_count()):
+                    device_info = self.p.get_device_info_by_index(i)
+                    devices.append(f"  {i}: {device_info['name']} "
+                                   f"(max input channels: {device_info['maxInputChannels']})")
+                logger.debug("Audio devices:\n" + "\n".join(devices))
         except Exception as e:
             logger.error(f"Failed to initialize PyAudio: {e}")
             raise
-        self.recording_thread = None
+        self.stream = None
+        self._sampwidth = self.p.get_sample_size(FORMAT)
+        self._capture_rate = self._pick_capture_rate()
+        # Resampler state carried across segments, which come from one continuous stream
+        self._ratecv_state = None
+        # Segment buffers rotate between PortAudio's callback and the writer thread
+        self._seg_bytes = int(self._capture_rate / CHUNK * RECORD_SECONDS) * CHUNK * self._sampwidth * CHANNELS
+        self._free_bufs = queue.Queue()
+        for _ in range(SEGMENT_BUFFERS):
+            self._free_bufs.put(bytearray(self._seg_bytes))
+        self._save_queue = queue.Queue(maxsize=SAVE_QUEUE_SIZE)
+        self._writer_thread = threading.Thread(target=self._writer_worker, daemon=True)
+        self._writer_thread.start()
+        # Segment being filled by _capture_callback, owned by PortAudio's thread while streaming
+        self._segment = None
+        self._seg_view = None
+        self._seg_off = 0
+        self._seg_started = 0.0
+        # Chunks lost to input overflow or a busy writer, reported with the next saved segment
+        self._overflows = 0
+        # Start and stop may come from the server's worker thread and its shutdown at once
+        self._state_lock = threading.Lock()
+
+    def _pick_capture_rate(self):
+        # Capture at the transfer rate when the device can, otherwise resample on save
+        try:
+            self.p.is_format_supported(TRANSFER_RATE,
+                                       input_device=0,
+                                       input_channels=CHANNELS,
+                                       input_format=FORMAT)
+            logger.info(f"Capturing at {TRANSFER_RATE} Hz")
+            return TRANSFER_RATE
+        except ValueError:
+            logger.info(f"Capturing at {RATE} Hz, resampling to {TRANSFER_RATE} Hz")
+            return RATE
 
     def start_recording(self):
-        if not self.is_recording:
-            logger.info("Starting audio recording")
-            try:
-                # Test audio device before starting
-                test_stream = self.p.open(
-                    format=FORMAT,
-                    channels=CHANNELS,
-                    rate=RATE,
-                    input=True,
-                    frames_per_buffer=CHUNK,
-                    start=False
-                )
-                test_stream.close()
-                logger.info("Audio device test successful")
-                
-                self.is_recording = True
-                self.recording_thread = threading.Thread(target=self._record_continuously)
-                self.recording_thread.start()
-                logger.info("Recording thread started")
-            except Exception as e:
-                logger.error(f"Failed to initialize audio recording: {e}")
-                raise
-        else:
-            logger.warning("Recording already in progress")
-
-    def _record_continuously(self):
-        while self.is_recording:
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = os.path.join(OUTPUT_DIR, f"audio_{timestamp}.wav")
-            
-            try:
-                # Specify the USB audio device explicitly
-                stream = self.p.open(format=FORMAT,
-                                   channels=CHANNELS,
-                                   rate=RATE,
-                                   input=True,
-                                   input_device_index=0,  # Use first USB device
-                                   frames_per_buffer=CHUNK)
-
-                logger.info(f"Started new recording segment: {filename}")
-                frames = []
-
-                for _ in range(0, int(RATE / CHUNK * RECORD_SECONDS)):
-                    if not self.is_recording:
-                        logger.info("Recording stopped by request")
-                        break
-                    try:
-                        data = stream.read(CHUNK, exception_on_overflow=False)
-                        frames.append(data)
-                    except Exception as e:
-                        logger.error(f"Error reading audio data: {e}")
-                        break
-
-                stream.stop_stream()
-                stream.close()
-
-                if frames:  # Only save if we actually recorded something
-                    wf = wave.open(filename, 'wb')
-                    wf.setnchannels(CHANNELS)
-                    wf.setsampwidth(self.p.get_sample_size(FORMAT))
-                    wf.setframerate(RATE)
-                    wf.writeframes(b''.join(frames))
-                    wf.close()
-
-                    file_queue.put(filename)
+        with self._state_lock:
+            if not self.is_recording:
+                logger.info("Starting audio recording")
+                try:
+                    self._ratecv_state = None
+                    self._overflows = 0
+                    # One stream for the whole session; segments are cut from it
+                    # Specify the USB audio device explicitly
+                    self.stream = self.p.open(format=FORMAT,
+                                              channels=CHANNELS,
+                                              rate=self._capture_rate,
+                                              input=True,
+                                              input_device_index=0,  # Use first USB device
+                                              frames_per_buffer=CHUNK,
+                                              stream_callback=self._capture_callback,
+                                              start=True)
+                    logger.info("Audio stream opened")
+
+                    self.is_recording = True
+                except Exception as e:
+                    logger.error(f"Failed to initialize audio recording: {e}")
+                    raise
+            else:
+                logger.warning("Recording already in progress")
+
+    def _capture_callback(self, in_data, frame_count, time_info, status):
+        # Runs on PortAudio's thread: copy into the current segment and never block
+        if status & pyaudio.paInputOverflow:
+            self._overflows += 1
+        data = memoryview(in_data)
+        while data:
+            if self._segment is None:
+                try:
+                    self._segment = self._free_bufs.get_nowait()
+                except queue.Empty:
+                    # Writer is behind and holds every buffer; lose this chunk rather than stall
+                    self._overflows += 1
+                    break
+                self._seg_view = memoryview(self._segment)
+                self._seg_off = 0
+                # Only stamp the segment here; the writer thread formats the name
+                self._seg_started = time.time()
+            n = min(len(data), self._seg_bytes - self._seg_off)
+            self._seg_view[self._seg_off:self._seg_off + n] = data[:n]
+            self._seg_off += n
+            data = data[n:]
+            if self._seg_off == self._seg_bytes:
+                self._finish_segment()
+        return (None, pyaudio.paContinue)
+
+    def _finish_segment(self):
+        """Hand the current segment to the writer thread"""
+        # Cannot block: there are fewer buffers than save queue slots
+        self._save_queue.put_nowait((self._seg_started, self._segment, self._seg_off, self._overflows))
+        self._overflows = 0
+        self._segment = None
+        self._seg_view = None
+
+    def _writer_worker(self):
+        # A stop and a quick restart can put two segments in the same second
+        last_name, repeats = None, 0
+        while True:
+            # Take everything that is pending so a backlog is written in one pass
+            batch = [self._save_queue.get()]
+            while len(batch) < SAVE_QUEUE_SIZE:
+                try:
+                    batch.append(self._save_queue.get_nowait())
+                except queue.Empty:
+                    break
+            for started, segment, size, overflows in batch:
+                filename = time.strftime(SEGMENT_PATH_FORMAT, time.localtime(started))
+                if filename == last_name:
+                    repeats += 1
+                    filename = f"{filename[:-len('.wav')]}_{repeats}.wav"
+                else:
+                    last_name, repeats = filename, 0
+                if overflows:
+                    logger.warning(f"Lost audio {overflows} time(s) to input overflow or a busy writer before {filename}")
+                try:
+                    self._save_segment(filename, segment, size)
+                    self._publish(filename)
                     logger.info(f"Successfully saved recording: {filename}")
-                    logger.info(f"File size: {os.path.getsize(filename)} bytes")
-            except Exception as e:
-                logger.error(f"Error during recording: {e}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"File size: {os.path.getsize(filename)} bytes")
+                except Exception as e:
+                    logger.error(f"Error saving recording {filename}: {e}")
+                finally:
+                    self._free_bufs.put(segment)
+                    self._save_queue.task_done()
+
+    def _publish(self, filename):
+        # Standalone, nothing transfers the files, so keep every recording on disk
+        if self._loop is not None:
+            # asyncio.Queue is not thread-safe, so hand the put to the loop's thread
+            self._loop.call_soon_threadsafe(_enqueue_file, filename)
+
+    def _save_segment(self, filename, segment, size):
+        pcm = memoryview(segment)[:size]
+        if self._capture_rate != TRANSFER_RATE:
+            pcm, self._ratecv_state = audioop.ratecv(pcm, self._sampwidth, CHANNELS,
+                                                     self._capture_rate, TRANSFER_RATE,
+                                                     self._ratecv_state)
+        ulaw = audioop.lin2ulaw(pcm, self._sampwidth)
+        header = _wav_header(len(ulaw) // CHANNELS, CHANNELS, 1, TRANSFER_RATE, WAVE_FORMAT_MULAW)
+        fd = os.open(filename, SEGMENT_OPEN_FLAGS, 0o644)
+        try:
+            # RIFF chunks are word-aligned, so odd-sized data gets a trailing pad byte
+            os.writev(fd, [header, ulaw, b'\0'] if len(ulaw) & 1 else [header, ulaw])
+        finally:
+            os.close(fd)
 
     def stop_recording(self):
-        if self.is_recording:
-            logger.info("Stopping audio recording")
-            self.is_recording = False
-            if self.recording_thread:
-                self.recording_thread.join()
-            self.p.terminate()
+        with self._state_lock:
+            if self.is_recording:
+                logger.info("Stopping audio recording")
+                self.is_recording = False
+                # Once stop_stream returns the callback has run for the last time
+                self.stream.stop_stream()
+                self.stream.close()
+                self.stream = None
+                # Save the partial segment the callback was filling
+                if self._segment is not None:
+                    if self._seg_off:
+                        self._finish_segment()
+                    else:
+                        self._free_bufs.put(self._segment)
+                        self._segment = None
+                        self._seg_view = None
+                # Let the writer finish any segments still waiting to be saved
+                self._save_queue.join()
 
     def get_next_file(self):
         """Get the next available audio file from the queue"""
-        if not file_queue.empty():
-            return file_queue.get()
-        return None 
+        try:
+            return file_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    async def wait_for_file(self):
+        """Wait until a saved audio file is available and return it"""
+        return await file_queue.get()
+
+    def return_file(self, filename):
+        """Put back a file that was taken from the queue but not fully transferred"""
+        # It is older than everything still queued, so the next client gets it first
+        file_queue.put_front_nowait(filename)
+
 
 def run_recorder():
     logger.info("Starting continuous recording service...")
@@ -1,41 +1,129 @@
 import asyncio
+import signal
+import mmap
 import os
+import socket
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from dbus_next.aio import MessageBus
-from dbus_next.service import ServiceInterface, method, dbus_property, signal, Variant
+from dbus_next.service import ServiceInterface, method, dbus_property, Variant
 from dbus_next.constants import BusType, PropertyAccess
-from record import AudioRecorder, logger
+from record import AudioRecorder, logger, CHANNELS, TRANSFER_RATE, TRANSFER_ENCODING
+from dbus_next import DBusError
+from dbus_next.introspection import Node
+try:
+    # libuv-backed loop with cheaper socket callbacks; asyncio's own loop otherwise
+    import uvloop
+except ImportError:
+    uvloop = None
+
+class InvalidArgsException(DBusError):
+    def __init__(self):
+        super().__init__('org.freedesktop.DBus.Error.InvalidArgs', 'Invalid arguments')
+
+class NotSupportedException(DBusError):
+    def __init__(self):
+        super().__init__('org.bluez.Error.NotSupported', 'Operation not supported')
+
+class NotPermittedException(DBusError):
+    def __init__(self):
+        super().__init__('org.bluez.Error.NotPermitted', 'Operation not permitted')
+
+class FailedException(DBusError):
+    def __init__(self):
+        super().__init__('org.bluez.Error.Failed', 'Operation failed')
+
+# ATT MTU used when BlueZ does not pass one (always for StartNotify), and the
+# per-notification header that is not available for payload
+DEFAULT_ATT_MTU = 23
+ATT_NOTIFY_HEADER = 3
+# Read responses carry a 1-byte header and at most 512 bytes of attribute value
+ATT_READ_HEADER = 1
+MAX_READ_CHUNK = 512
+# How long to keep our copy of the fd handed to BlueZ, so the reply carrying it
+# is on the wire before we close it and can see BlueZ hang up
+FD_HANDOFF_SECONDS = 1
+# Notifications written back to back before yielding to the event loop
+NOTIFY_BATCH = 32
+# Separator framing connection events in the log
+BANNER = "=" * 50
+# Characteristic User Description descriptor telling clients how to decode the audio
+FORMAT_DESCRIPTOR_UUID = "00002901-0000-1000-8000-00805f9b34fb"
+AUDIO_FORMAT = f"{TRANSFER_ENCODING};rate={TRANSFER_RATE};channels={CHANNELS}".encode()
+
+# The GATT object tree; the interfaces and the GetManagedObjects reply share these
+SERVICE_PATH = '/org/bluez/example/service0'
+CHARACTERISTIC_PATH = '/org/bluez/example/characteristic0'
+DESCRIPTOR_PATH = CHARACTERISTIC_PATH + '/desc0'
+SERVICE_UUID = "12345678-1234-5678-1234-56789abcdef0"
+CHARACTERISTIC_UUID = "abcdef01-1234-5678-1234-56789abcdef0"
+# No pairing agent is registered, so the value must stay readable without encryption
+CHARACTERISTIC_FLAGS = ['read', 'notify']
+
+def map_file(path):
+    """Map path read-only; the mapping stays valid after the fd is closed"""
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC | getattr(os, 'O_NOATIME', 0))
+    try:
+        mm = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+    finally:
+        os.close(fd)
+    # Segments are only ever walked front to back, so let the kernel read ahead
+    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    return mm
+
+def remove_files(paths):
+    """Delete transferred recordings; runs on an executor thread, off the D-Bus loop"""
+    for path in paths:
+        try:
+            os.remove(path)
+            logger.info(f"File transfer complete, deleted: {path}")
+        except OSError as e:
+            logger.error(f"Failed to delete {path}: {e}")
 
 class GATTApplication(ServiceInterface):
     def __init__(self):
         super().__init__('org.bluez.GattApplication1')
-        self._services = ['/org/bluez/example/service0']
-
-    @method()
-    def GetManagedObjects(self) -> 'a{oa{sa{sv}}}':
-        return {
-            '/org/bluez/example/service0': {
+        self._services = [SERVICE_PATH]
+        # The object tree never changes, so build the reply once
+        self._managed = {
+            SERVICE_PATH: {
                 'org.bluez.GattService1': {
-                    'UUID': Variant('s', "12345678-1234-5678-1234-56789abcdef0"),
+                    'UUID': Variant('s', SERVICE_UUID),
                     'Primary': Variant('b', True),
-                    'Characteristics': Variant('ao', ['/org/bluez/example/characteristic0'])
+                    'Characteristics': Variant('ao', [CHARACTERISTIC_PATH])
                 }
             },
-            '/org/bluez/example/characteristic0': {
+            CHARACTERISTIC_PATH: {
                 'org.bluez.GattCharacteristic1': {
-                    'UUID': Variant('s', "abcdef01-1234-5678-1234-56789abcdef0"),
-                    'Service': Variant('o', '/org/bluez/example/service0'),
-                    'Flags': Variant('as', ['read', 'notify']),
-                    'Value': Variant('ay', b'')
+                    'UUID': Variant('s', CHARACTERISTIC_UUID),
+                    'Service': Variant('o', SERVICE_PATH),
+                    'Flags': Variant('as', CHARACTERISTIC_FLAGS),
+                    'Value': Variant('ay', b''),
+                    # BlueZ only offers AcquireNotify when this property exists
+                    'NotifyAcquired': Variant('b', False)
+                }
+            },
+            DESCRIPTOR_PATH: {
+                'org.bluez.GattDescriptor1': {
+                    'UUID': Variant('s', FORMAT_DESCRIPTOR_UUID),
+                    'Characteristic': Variant('o', CHARACTERISTIC_PATH),
+                    'Flags': Variant('as', ['read']),
+                    'Value': Variant('ay', AUDIO_FORMAT)
                 }
             }
         }
 
+    @method()
+    def GetManagedObjects(self) -> 'a{oa{sa{sv}}}':
+        return self._managed
+
 class GATTService(ServiceInterface):
     def __init__(self):
         super().__init__('org.bluez.GattService1')
-        self._uuid = "12345678-1234-5678-1234-56789abcdef0"
+        self._uuid = SERVICE_UUID
         self._primary = True
+        self._characteristics = [CHARACTERISTIC_PATH]
 
     @dbus_property(access=PropertyAccess.READ)
     def UUID(self) -> 's':
@@ -47,18 +135,51 @@ class GATTService(ServiceInterface):
 
     @dbus_property(access=PropertyAccess.READ)
     def Characteristics(self) -> 'ao':
-        return ['/org/bluez/example/characteristic0']
+        return self._characteristics
 
 class GATTCharacteristic(ServiceInterface):
     def __init__(self, recorder: AudioRecorder):
         super().__init__('org.bluez.GattCharacteristic1')
-        self._uuid = "abcdef01-1234-5678-1234-56789abcdef0"
-        self._flags = ['read', 'notify']
-        self._service = '/org/bluez/example/service0'
+        self._uuid = CHARACTERISTIC_UUID
+        self._flags = CHARACTERISTIC_FLAGS
+        self._service = SERVICE_PATH
         self._value = b''
+        # GetAll reply; only Value and NotifyAcquired change, so only they are refreshed per call
+        self._all_props = {
+            'UUID': Variant('s', self._uuid),
+            'Service': Variant('o', self._service),
+            'Flags': Variant('as', self._flags),
+            'Value': Variant('ay', self._value),
+            'NotifyAcquired': Variant('b', False)
+        }
         self.recorder = recorder
-        self._clients = set()
-        logger.info("GATTCharacteristic initialized")
+        # Recorder starts and stops run off the loop on one worker thread, so they
+        # take effect in the order clients came and went
+        self._recorder_ops = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recorder')
+        self._shut_down = False
+        # StartNotify and AcquireNotify subscribers; the recorder runs while any remain
+        self._client_count = 0
+        # StartNotify subscribers alone; Value changes are pushed while any remain
+        self._subscribers = 0
+        self.notifying = False
+        self._notify_sock = None
+        self._notify_task = None
+        # Task emitting Value changes for StartNotify subscribers
+        self._push_task = None
+        # File currently being served to ReadValue, mapped once and walked in order
+        self._read_file = None
+        self._read_mm = None
+        self._read_off = 0
+        # Transferred files waiting to be deleted, drained in batches off the loop
+        self._pending_delete = asyncio.Queue()
+        self._delete_task = None
+
+    def notify_value(self, value):
+        if not self.notifying:
+            return
+        # BlueZ turns org.freedesktop.DBus.Properties.PropertiesChanged on Value into a notification
+        self._value = bytes(value)
+        self.emit_properties_changed({'Value': self._value})
 
     @dbus_property(access=PropertyAccess.READ)
     def UUID(self) -> 's':
@@ -76,161 +197,386 @@ class GATTCharacteristic(ServiceInterface):
     def Value(self) -> 'ay':
         return self._value
 
-    @method()
-    def ReadValue(self, options: 'a{sv}') -> 'ay':
-        next_file = self.recorder.get_next_file()
-        if next_file:
+    @method(name='ReadValue')
+    def read_value(self, options: 'a{sv}') -> 'ay':
+        try:
+            if 'mtu' in options:
+                mtu = options['mtu'].value
+                # Fit each read in one response so BlueZ never needs a long read
+                size = min(mtu - ATT_READ_HEADER, MAX_READ_CHUNK)
+            else:
+                size = MAX_READ_CHUNK
+            chunk = self._next_read_chunk(size)
+            if chunk and logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Sending chunk of size {len(chunk)} bytes")
+            return chunk
+        except Exception as e:
+            logger.error(f"Error in ReadValue: {e}")
+            raise NotSupportedException()
+
+    def _next_read_chunk(self, size):
+        """Return the next size bytes of the file being read, moving to the next file once drained"""
+        if self._read_mm is None:
+            next_file = self.recorder.get_next_file()
+            if not next_file:
+                return b''
             try:
-                with open(next_file, 'rb') as f:
-                    chunk = f.read(512)
-                    if chunk:
-                        logger.info(f"Sending chunk of size {len(chunk)} bytes")
-                        return list(chunk)
-                    os.remove(next_file)
-                    logger.info(f"File transfer complete, deleted: {next_file}")
-            except Exception as e:
-                logger.error(f"Error sending file {next_file}: {e}")
-        return []
+                self._read_mm = map_file(next_file)
+            except (OSError, ValueError):
+                # Unreadable, or empty (mmap rejects zero length); don't leave it in recordings/
+                self._delete_later(next_file)
+                raise
+            self._read_file = next_file
+            self._read_off = 0
+        chunk = self._read_mm[self._read_off:self._read_off + size]
+        self._read_off += len(chunk)
+        if self._read_off >= len(self._read_mm):
+            self._read_mm.close()
+            self._read_mm = None
+            self._delete_later(self._read_file)
+        return chunk
 
-    @method()
-    def StartNotify(self):
-        sender = self.get_sender()
-        logger.info("=" * 50)
+    def _delete_later(self, path):
+        """Queue a transferred file for deletion without waiting on the unlink"""
+        self._pending_delete.put_nowait(path)
+        if self._delete_task is None:
+            self._delete_task = asyncio.get_running_loop().create_task(self._delete_files())
+
+    async def _delete_files(self):
+        """Unlink queued files, everything pending at once in one executor job"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._pending_delete.get()]
+            while not self._pending_delete.empty():
+                batch.append(self._pending_delete.get_nowait())
+            await loop.run_in_executor(None, remove_files, batch)
+
+    async def _start_recorder(self):
+        """Start the recorder off the loop, once any stop queued before it has finished"""
+        await asyncio.get_running_loop().run_in_executor(self._recorder_ops, self.recorder.start_recording)
+
+    def _stop_recorder(self):
+        """Stop the recorder off the loop; closing the stream waits out the last capture buffer"""
+        if self._shut_down:
+            return  # Already stopped for good; clients are only being torn down
+        asyncio.get_running_loop().run_in_executor(self._recorder_ops, self.recorder.stop_recording)
+
+    async def shutdown(self):
+        """Stop the recorder for good, after every start and stop already queued"""
+        stopped = asyncio.get_running_loop().run_in_executor(self._recorder_ops, self.recorder.stop_recording)
+        # Refuse anything queued from now on, so no late start can reopen the stream
+        self._recorder_ops.shutdown(wait=False)
+        self._shut_down = True
+        await stopped
+
+    @method(name='StartNotify')
+    async def start_notify(self) -> None:
+        logger.info(BANNER)
         logger.info(f"StartNotify called!")
         logger.info(f"New client connected!")
-        logger.info(f"Client ID: {sender}")
-        logger.info("Starting audio recording...")
-        logger.info("=" * 50)
-        self._clients.add(sender)
-        if len(self._clients) == 1:  # First client connected
+        logger.info(f"Current number of clients: {self._client_count}")
+        logger.info(f"Is recording already?: {self.recorder.is_recording}")
+        self._client_count += 1
+        self._subscribers += 1
+        # Subscribe before awaiting the start, so a StopNotify that arrives meanwhile
+        # sees this client and undoes all of it
+        self.notifying = True
+        if self._push_task is None:
+            self._push_task = asyncio.get_running_loop().create_task(self._push_notifications())
+        if self._client_count == 1:  # First client connected
             logger.info("First client connected, starting recorder")
-            self.recorder.start_recording()
+            try:
+                await self._start_recorder()
+                logger.info("Recording started successfully")
+            except Exception as e:
+                logger.error(f"Failed to start recording: {e}")
+                # Unsubscribe again so the next StartNotify is the first client and retries
+                self._client_count = max(0, self._client_count - 1)
+                self._subscribers = max(0, self._subscribers - 1)
+                if not self._subscribers:
+                    self.notifying = False
+                    if self._push_task is not None:
+                        self._push_task.cancel()
+                        self._push_task = None
+                raise FailedException()
         else:
-            logger.info(f"Additional client connected. Total clients: {len(self._clients)}")
+            logger.info(f"Additional client connected. Total clients: {self._client_count}")
+        logger.info(BANNER)
 
-    @method()
-    def StopNotify(self):
-        sender = self.get_sender()
-        logger.info("=" * 50)
+    @method(name='StopNotify')
+    def stop_notify(self) -> None:
+        logger.info(BANNER)
         logger.info(f"Client disconnected!")
-        logger.info(f"Client ID: {sender}")
-        logger.info("=" * 50)
-        self._clients.discard(sender)
-        if not self._clients:  # No more clients connected
-            self.recorder.stop_recording()
+        logger.info(BANNER)
+        if not self._subscribers:
+            return
+        self._subscribers -= 1
+        self._client_count = max(0, self._client_count - 1)
+        # Stop pushing even if an AcquireNotify socket is still live, or the push task
+        # would keep taking segments away from it
+        if not self._subscribers:
+            self.notifying = False
+            if self._push_task is not None:
+                self._push_task.cancel()
+                self._push_task = None
+        if not self._client_count:  # No more clients connected
+            self._stop_recorder()
+
+    async def _push_notifications(self):
+        """Emit each saved segment as Value changes while a client is subscribed"""
+        # StartNotify does not say which device subscribed or its MTU, and BlueZ cuts each
+        # notification to that device's MTU - 3, so only the minimum MTU is safe
+        payload = DEFAULT_ATT_MTU - ATT_NOTIFY_HEADER
+        next_file = None
+        try:
+            while True:
+                next_file = await self.recorder.wait_for_file()
+                with map_file(next_file) as mm:
+                    for n, offset in enumerate(range(0, len(mm), payload), 1):
+                        self.notify_value(mm[offset:offset + payload])
+                        if n % NOTIFY_BATCH == 0:
+                            await asyncio.sleep(0)  # Let the bus writer drain
+                self._delete_later(next_file)
+                next_file = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending notifications: {e}")
+            # Drop the file that failed rather than hand it to the next client
+            if next_file is not None:
+                self._delete_later(next_file)
+                next_file = None
+        finally:
+            if next_file is not None:
+                # Unsubscribed mid-file; keep the file for the next client
+                self.recorder.return_file(next_file)
+            if self._push_task is asyncio.current_task():
+                self._push_task = None
+
+    @dbus_property(access=PropertyAccess.READ)
+    def NotifyAcquired(self) -> 'b':
+        return self._notify_sock is not None
+
+    @method(name='AcquireNotify')
+    async def acquire_notify(self, options: 'a{sv}') -> 'hq':
+        if self._notify_sock is not None:
+            raise NotPermittedException()
+        mtu = options['mtu'].value if 'mtu' in options else DEFAULT_ATT_MTU
+        client = options['device'].value if 'device' in options else 'AcquireNotify'
+        # SEQPACKET keeps every write a single notification on BlueZ's side
+        ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        ours.setblocking(False)
+        # Claim the socket and count the client before awaiting the start, so a second
+        # AcquireNotify is refused and a StopNotify cannot stop the recorder meanwhile
+        self._notify_sock = ours
+        self._client_count += 1
+        if self._client_count == 1:  # First client connected
+            try:
+                await self._start_recorder()
+            except Exception as e:
+                logger.error(f"Failed to start recording: {e}")
+                ours.close()
+                theirs.close()
+                self._notify_sock = None
+                self._client_count = max(0, self._client_count - 1)
+                raise FailedException()
+        logger.info(f"Notify acquired by {client}, MTU {mtu}")
+        self.emit_properties_changed({'NotifyAcquired': True})
+        loop = asyncio.get_running_loop()
+        self._notify_task = loop.create_task(
+            self._pump_notifications(ours, mtu - ATT_NOTIFY_HEADER))
+        loop.call_later(FD_HANDOFF_SECONDS, theirs.close)
+        return [theirs.fileno(), mtu]
+
+    async def _pump_notifications(self, sock, payload):
+        """Send each saved segment through the AcquireNotify socket, one notification per packet"""
+        loop = asyncio.get_running_loop()
+        next_file = None
+        try:
+            while True:
+                next_file = await self.recorder.wait_for_file()
+                # Send views of the mapping so the kernel copies straight from the page cache;
+                # every view must be released before the mapping can close
+                with map_file(next_file) as mm, memoryview(mm) as view:
+                    for n, offset in enumerate(range(0, len(view), payload), 1):
+                        with view[offset:offset + payload] as chunk:
+                            try:
+                                sock.send(chunk)
+                            except BlockingIOError:
+                                # Suspend only while the socket is full, i.e. BlueZ is behind. Hand
+                                # over a copy: sock_sendall keeps its own view, which would pin the
+                                # mapping open if BlueZ hung up meanwhile
+                                await loop.sock_sendall(sock, bytes(chunk))
+                        if n % NOTIFY_BATCH == 0:
+                            await asyncio.sleep(0)  # Let other D-Bus traffic through
+                self._delete_later(next_file)
+                next_file = None
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Notification socket closed by BlueZ")
+        except Exception as e:
+            logger.error(f"Error sending notifications: {e}")
+            # Drop the file that failed rather than hand it to the next client
+            if next_file is not None:
+                self._delete_later(next_file)
+                next_file = None
+        finally:
+            if next_file is not None:
+                # BlueZ hung up mid-file; keep the file for the next client
+                self.recorder.return_file(next_file)
+            sock.close()
+            self._notify_sock = None
+            self._notify_task = None
+            self.emit_properties_changed({'NotifyAcquired': False})
+            self._client_count = max(0, self._client_count - 1)
+            if not self._client_count:  # No more clients connected
+                self._stop_recorder()
+
+    @method(name='GetAll')
+    def get_all(self, interface: 's') -> 'a{sv}':
+        if interface != 'org.bluez.GattCharacteristic1':
+            raise InvalidArgsException()
+
+        self._all_props['Value'] = Variant('ay', self._value)
+        self._all_props['NotifyAcquired'] = Variant('b', self._notify_sock is not None)
+        return self._all_props
+
+class GATTDescriptor(ServiceInterface):
+    def __init__(self):
+        super().__init__('org.bluez.GattDescriptor1')
+        self._uuid = FORMAT_DESCRIPTOR_UUID
+        self._characteristic = CHARACTERISTIC_PATH
+        self._flags = ['read']
+        self._value = AUDIO_FORMAT
+
+    @dbus_property(access=PropertyAccess.READ)
+    def UUID(self) -> 's':
+        return self._uuid
+
+    @dbus_property(access=PropertyAccess.READ)
+    def Characteristic(self) -> 'o':
+        return self._characteristic
+
+    @dbus_property(access=PropertyAccess.READ)
+    def Flags(self) -> 'as':
+        return self._flags
+
+    @dbus_property(access=PropertyAccess.READ)
+    def Value(self) -> 'ay':
+        return self._value
+
+    @method(name='ReadValue')
+    def read_value(self, options: 'a{sv}') -> 'ay':
+        offset = options['offset'].value if 'offset' in options else 0
+        return self._value[offset:]
+
+class Advertisement(ServiceInterface):
+    def __init__(self):
+        super().__init__('org.bluez.LEAdvertisement1')
+        self._type = 'peripheral'
+        self._service_uuids = [SERVICE_UUID]
+        self._local_name = 'RaspberryPiAudio'
+        self._appearance = 0x0340
+        self._include_tx_power = True
+        self._discoverable = True
+
+    @dbus_property(access=PropertyAccess.READ)
+    def Type(self) -> 's':
+        return self._type
+
+    @dbus_property(access=PropertyAccess.READ)
+    def ServiceUUIDs(self) -> 'as':
+        return self._service_uuids
+
+    @dbus_property(access=PropertyAccess.READ)
+    def LocalName(self) -> 's':
+        return self._local_name
+
+    @dbus_property(access=PropertyAccess.READ)
+    def Appearance(self) -> 'q':
+        return self._appearance
+
+    @dbus_property(access=PropertyAccess.READ)
+    def IncludeTxPower(self) -> 'b':
+        return self._include_tx_power
+
+    @dbus_property(access=PropertyAccess.READ)
+    def Discoverable(self) -> 'b':
+        return self._discoverable
+
+    @method(name='Release')
+    def release(self) -> None:
+        logger.info("Advertisement released by BlueZ")
+
+# Adapter interfaces used by setup_bluez, parsed once at import
+ADAPTER_INTROSPECTION = Node.parse('''
+<node>
+    <interface name="org.bluez.Adapter1">
+        <property name="Powered" type="b" access="readwrite"/>
+        <property name="Discoverable" type="b" access="readwrite"/>
+        <property name="DiscoverableTimeout" type="u" access="readwrite"/>
+        <property name="Pairable" type="b" access="readwrite"/>
+        <property name="PairableTimeout" type="u" access="readwrite"/>
+        <property name="Alias" type="s" access="readwrite"/>
+    </interface>
+    <interface name="org.bluez.LEAdvertisingManager1">
+        <method name="RegisterAdvertisement">
+            <arg name="advertisement" type="o" direction="in"/>
+            <arg name="options" type="a{sv}" direction="in"/>
+        </method>
+    </interface>
+    <interface name="org.freedesktop.DBus.Properties">
+        <method name="Get">
+            <arg name="interface" type="s" direction="in"/>
+            <arg name="property" type="s" direction="in"/>
+            <arg name="value" type="v" direction="out"/>
+        </method>
+        <method name="Set">
+            <arg name="interface" type="s" direction="in"/>
+            <arg name="property" type="s" direction="in"/>
+            <arg name="value" type="v" direction="in"/>
+        </method>
+    </interface>
+</node>
+''')
 
 async def setup_bluez():
-    bus = await MessageBus(bus_type=BusType.SYSTEM).connect()
+    # AcquireNotify hands a socket to BlueZ, which needs fd passing
+    bus = await MessageBus(bus_type=BusType.SYSTEM, negotiate_unix_fd=True).connect()
     
     # Configure adapter for advertising
     adapter_path = '/org/bluez/hci0'
     
-    # Define Advertisement class
-    class Advertisement(ServiceInterface):
-        def __init__(self):
-            super().__init__('org.bluez.LEAdvertisement1')
-            self._type = 'peripheral'
-            self._service_uuids = ["12345678-1234-5678-1234-56789abcdef0"]
-            self._local_name = 'RaspberryPiAudio'
-            self._includes = []
-            self._manufacturer_data = {}
-            self._service_data = {}
-            self._discoverable = True
-            
-        @dbus_property(access=PropertyAccess.READ)
-        def Type(self) -> 's':
-            return self._type
-            
-        @dbus_property(access=PropertyAccess.READ)
-        def ServiceUUIDs(self) -> 'as':
-            return self._service_uuids
-            
-        @dbus_property(access=PropertyAccess.READ)
-        def LocalName(self) -> 's':
-            return self._local_name
-
-        @dbus_property(access=PropertyAccess.READ)
-        def Includes(self) -> 'as':
-            return self._includes
-
-        @dbus_property(access=PropertyAccess.READ)
-        def ManufacturerData(self) -> 'a{qv}':
-            return self._manufacturer_data
-
-        @dbus_property(access=PropertyAccess.READ)
-        def ServiceData(self) -> 'a{sv}':
-            return self._service_data
-
-        @dbus_property(access=PropertyAccess.READ)
-        def Discoverable(self) -> 'b':
-            return self._discoverable
-
-        @method()
-        def Release(self):
-            pass
-    
-    # Update introspection data
-    adapter_introspection = '''
-        <node>
-            <interface name="org.bluez.Adapter1">
-                <property name="Powered" type="b" access="readwrite"/>
-                <property name="Discoverable" type="b" access="readwrite"/>
-                <property name="DiscoverableTimeout" type="u" access="readwrite"/>
-                <property name="Pairable" type="b" access="readwrite"/>
-                <property name="PairableTimeout" type="u" access="readwrite"/>
-                <property name="Alias" type="s" access="readwrite"/>
-            </interface>
-            <interface name="org.bluez.LEAdvertisingManager1">
-                <method name="RegisterAdvertisement">
-                    <arg name="advertisement" type="o" direction="in"/>
-                    <arg name="options" type="a{sv}" direction="in"/>
-                </method>
-            </interface>
-            <interface name="org.freedesktop.DBus.Properties">
-                <method name="Get">
-                    <arg name="interface" type="s" direction="in"/>
-                    <arg name="property" type="s" direction="in"/>
-                    <arg name="value" type="v" direction="out"/>
-                </method>
-                <method name="Set">
-                    <arg name="interface" type="s" direction="in"/>
-                    <arg name="property" type="s" direction="in"/>
-                    <arg name="value" type="v" direction="in"/>
-                </method>
-            </interface>
-        </node>
-    '''
+    # Get proxy object with introspection data
+    proxy_obj = bus.get_proxy_object('org.bluez', adapter_path, ADAPTER_INTROSPECTION)
+    properties = proxy_obj.get_interface('org.freedesktop.DBus.Properties')
+    le_advertising = proxy_obj.get_interface('org.bluez.LEAdvertisingManager1')
     
     try:
-        # First make sure adapter is powered off
-        proxy_obj = bus.get_proxy_object('org.bluez', adapter_path, adapter_introspection)
-        properties = proxy_obj.get_interface('org.freedesktop.DBus.Properties')
-        await properties.call_set('org.bluez.Adapter1', 'Powered', Variant('b', False))
-        await asyncio.sleep(1)  # Give it a moment
-        
-        # Now configure adapter
+        # Power the adapter first
         await properties.call_set('org.bluez.Adapter1', 'Powered', Variant('b', True))
-        await properties.call_set('org.bluez.Adapter1', 'Discoverable', Variant('b', True))
-        await properties.call_set('org.bluez.Adapter1', 'DiscoverableTimeout', Variant('u', 0))
+        # The rest only need a powered adapter, not each other
+        await asyncio.gather(
+            properties.call_set('org.bluez.Adapter1', 'Discoverable', Variant('b', True)),
+            properties.call_set('org.bluez.Adapter1', 'DiscoverableTimeout', Variant('u', 0)),
+            properties.call_set('org.bluez.Adapter1', 'Pairable', Variant('b', True)),
+            properties.call_set('org.bluez.Adapter1', 'PairableTimeout', Variant('u', 0)),
+            properties.call_set('org.bluez.Adapter1', 'Alias', Variant('s', 'RaspberryPiAudio')),
+        )
         
-        logger.info("Bluetooth adapter configured")
+        logger.info("Bluetooth adapter configured for advertising")
         
         # Create and register advertisement
         advertisement = Advertisement()
         bus.export('/org/bluez/example/advertisement0', advertisement)
-        
-        le_advertising = proxy_obj.get_interface('org.bluez.LEAdvertisingManager1')
         await le_advertising.call_register_advertisement('/org/bluez/example/advertisement0', {})
         
         logger.info("Bluetooth LE advertising enabled with custom service UUID")
-        
-        # Rest of the setup...
     except Exception as e:
         logger.error(f"Failed to configure advertising: {e}")
         raise
     
-    # Create recorder instance
-    recorder = AudioRecorder()
+    # Create recorder instance; saved files are queued on this loop
+    recorder = AudioRecorder(loop=asyncio.get_running_loop())
 
     # Register the application
     app = GATTApplication()
@@ -238,34 +584,46 @@ async def setup_bluez():
 
     # Register the service
     service = GATTService()
-    bus.export('/org/bluez/example/service0', service)
+    bus.export(SERVICE_PATH, service)
 
     # Register the characteristic
     characteristic = GATTCharacteristic(recorder)
-    bus.export('/org/bluez/example/characteristic0', characteristic)
+    bus.export(CHARACTERISTIC_PATH, characteristic)
+    logger.info(f"Registered characteristic with UUID: {characteristic._uuid}")
+    logger.info(f"Characteristic flags: {characteristic._flags}")
+    logger.info(f"Characteristic service: {characteristic._service}")
+
+    # Register the descriptor advertising the audio encoding
+    descriptor = GATTDescriptor()
+    bus.export(DESCRIPTOR_PATH, descriptor)
 
     logger.info("BLE services registered and advertising")
-    return bus, recorder
+    return bus, characteristic
 
 async def main():
     logger.info("Starting BLE GATT server...")
     
     # Setup D-Bus and BlueZ
-    bus, recorder = await setup_bluez()
+    bus, characteristic = await setup_bluez()
     
-    logger.info("=" * 50)
+    logger.info(BANNER)
     logger.info("BLE GATT server running...")
     logger.info("Waiting for connections...")
-    logger.info("Service UUID: 12345678-1234-5678-1234-56789abcdef0")
-    logger.info("Characteristic UUID: abcdef01-1234-5678-1234-56789abcdef0")
-    logger.info("=" * 50)
+    logger.info(f"Service UUID: {SERVICE_UUID}")
+    logger.info(f"Characteristic UUID: {CHARACTERISTIC_UUID}")
+    logger.info(BANNER)
     
-    try:
-        while True:
-            await asyncio.sleep(1)
-    except KeyboardInterrupt:
-        recorder.stop_recording()
-        logger.info("Server stopped")
+    # Idle until asked to stop; no timer wakes the loop in the meantime
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    await stop.wait()
+    await characteristic.shutdown()
+    logger.info("Server stopped")
 
 if __name__ == '__main__':
-    asyncio.run(main()) 
\ No newline at end of file
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())